@@ -0,0 +1,96 @@
+"""
+Compare the thread and process backends of transform_many.
+
+Run from impls/python:
+
+    PYTHONPATH=. python benchmarks/backends.py --records 20000 --workers 8
+
+Threads only run in parallel on free-threaded Python (3.13t and later); on a
+regular build they show the cost of the GIL instead.
+"""
+
+import argparse
+import sys
+import time
+
+from jsonlt import transform_many
+from jsonlt.xform import gil_disabled
+
+CONFIG = {
+    "transformations": [
+        {
+            "type": "rename",
+            "path": ".person",
+            "source": "firstName",
+            "target": "givenName",
+        },
+        {
+            "type": "rename",
+            "path": ".person",
+            "source": "lastName",
+            "target": "familyName",
+        },
+        {
+            "type": "concat",
+            "path": ".person",
+            "sources": ["givenName", "familyName"],
+            "target": "fullName",
+            "delimiter": " ",
+        },
+        {
+            "type": "modify_text",
+            "path": ".person",
+            "target": "fullName",
+            "modification": "title",
+        },
+        {
+            "type": "conditional",
+            "path": ".person",
+            "condition": {"operator": "gt", "left": "age", "right": 18},
+            "true_transformation": {"type": "add", "target": "isAdult", "value": True},
+            "false_transformation": {
+                "type": "add",
+                "target": "isAdult",
+                "value": False,
+            },
+        },
+        {
+            "type": "reorder",
+            "path": ".person",
+            "order": ["fullName", "age", "isAdult", "address"],
+        },
+    ]
+}
+
+
+def make_record(i):
+    return {
+        "person": {
+            "firstName": f"first{i}",
+            "lastName": f"last{i}",
+            "age": i % 90,
+            "address": {"street": f"{i} Main St", "city": "Anytown"},
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare transform_many backends")
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    records = [make_record(i) for i in range(args.records)]
+    print(f"Python {sys.version.split()[0]}, GIL disabled: {gil_disabled()}")
+    for backend in ("threads", "processes"):
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            transform_many(records, CONFIG, backend=backend, max_workers=args.workers)
+            timings.append(time.perf_counter() - start)
+        print(f"{backend:>9}: {min(timings):.3f}s for {args.records} records")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,8 @@
+from .xform import ShapeCache
+from .xform import apply_plan as apply
+from .xform import compile_jsonlt as compile
 from .xform import jsonlt_transform as transform
+from .xform import jsonlt_transform_fanout as transform_fanout
+from .xform import jsonlt_transform_many as transform_many
+from .specialize import infer_schema
+from .specialize import specialize_plan as specialize
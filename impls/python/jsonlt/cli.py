@@ -2,7 +2,7 @@ import argparse
 import json
 import sys
 
-from .xform import jsonlt_transform
+from .xform import jsonlt_transform, jsonlt_transform_fanout
 
 
 def interactive_mode():
@@ -29,6 +29,27 @@ def interactive_mode():
     json.dump(result, sys.stdout, indent=2)
 
 
+def fanout_mode(input_path, targets):
+    try:
+        with open(input_path, "r") as f:
+            input_data = json.load(f)
+
+        jsonlt_configs = []
+        for config_path, _ in targets:
+            with open(config_path, "r") as f:
+                jsonlt_configs.append(json.load(f))
+
+        results = jsonlt_transform_fanout(input_data, jsonlt_configs)
+
+        for (_, output_path), result in zip(targets, results):
+            with open(output_path, "w") as f:
+                json.dump(result, f, indent=2)
+
+    except Exception as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+
 def main():
     parser = argparse.ArgumentParser(description="JSONLT: JSON Transformation Tool")
     parser.add_argument(
@@ -37,6 +58,14 @@ def main():
     parser.add_argument("input", nargs="?", help="Input JSON file")
     parser.add_argument("config", nargs="?", help="JSONLT configuration file")
     parser.add_argument("-o", "--output", help="Output JSON file (default: stdout)")
+    parser.add_argument(
+        "--config",
+        action="append",
+        dest="fanout",
+        metavar="CONFIG:OUTPUT",
+        help="Apply CONFIG and write the result to OUTPUT; may be repeated to "
+        "run several configurations over a single parse of the input",
+    )
 
     args = parser.parse_args()
 
@@ -44,6 +73,20 @@ def main():
         interactive_mode()
         return
 
+    if args.fanout:
+        if not args.input or args.config or args.output:
+            parser.error(
+                "--config takes an input file and no positional config or --output"
+            )
+        targets = []
+        for spec in args.fanout:
+            config_path, sep, output_path = spec.rpartition(":")
+            if not sep or not config_path or not output_path:
+                parser.error(f"--config expects CONFIG:OUTPUT, got {spec!r}")
+            targets.append((config_path, output_path))
+        fanout_mode(args.input, targets)
+        return
+
     if not args.input or not args.config:
         parser.error("Input and config files are required when not in interactive mode")
 
@@ -0,0 +1,312 @@
+# Reference tables for the lookup transformation
+
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Magic, number of entries, size and mtime of the indexed file, reference key tag
+INDEX_HEADER = struct.Struct("<8sQQQ8s")
+INDEX_ENTRY = struct.Struct("<QQ")  # Key hash, byte offset of the row
+INDEX_MAGIC = b"JLTIDX2\0"
+
+# Index entries sorted in memory at a time while building an index
+INDEX_CHUNK_ENTRIES = 1 << 16
+# Bytes read at a time from each sorted chunk while merging them
+RUN_BLOCK_SIZE = INDEX_ENTRY.size * 4096
+
+
+def normalize_key(value: Any) -> Any:
+    """
+    Return the form of a value both tables index it by, or None if it is no key.
+
+    Strings and numbers are keys, booleans are not. Numbers that are equal are
+    the same key, so 1 and 1.0 both match a row keyed 1.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (str, int)):
+        return value
+    if isinstance(value, float) and math.isfinite(value):
+        return int(value) if value.is_integer() else value
+    return None
+
+
+def key_hash(value: Any) -> int:
+    # Python's str hash is salted per process, the index has to be stable
+    digest = hashlib.blake2b(json.dumps(value).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def reference_key_tag(reference_key: str) -> bytes:
+    return hashlib.blake2b(reference_key.encode(), digest_size=8).digest()
+
+
+def select_fields(row: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return row
+    return {field: row[field] for field in fields if field in row}
+
+
+def is_json_array(path: str) -> bool:
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            stripped = chunk.lstrip()
+            if stripped:
+                return stripped[:1] == b"["
+    return False
+
+
+def read_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the objects of a JSON array or NDJSON file."""
+    if is_json_array(path):
+        with open(path, "rb") as f:
+            rows = json.load(f)
+        for row in rows:
+            if isinstance(row, dict):
+                yield row
+        return
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                if isinstance(row, dict):
+                    yield row
+
+
+def index_entries(f: BinaryIO, reference_key: str) -> Iterator[Tuple[int, int]]:
+    """Yield the (key hash, row offset) index entries of an NDJSON file in order."""
+    offset = 0
+    for line in f:
+        if line.strip():
+            row = json.loads(line)
+            key = normalize_key(
+                row.get(reference_key) if isinstance(row, dict) else None
+            )
+            if key is not None:
+                yield key_hash(key), offset
+        offset += len(line)
+
+
+def write_run(runs: BinaryIO, chunk: List[Tuple[int, int]]) -> Tuple[int, int]:
+    """Append a chunk of index entries to runs, sorted, and return its bounds."""
+    chunk.sort()
+    start = runs.tell()
+    runs.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in chunk))
+    return start, runs.tell()
+
+
+def read_run(mapped: Any, start: int, end: int) -> Iterator[Tuple[int, int]]:
+    for position in range(start, end, RUN_BLOCK_SIZE):
+        block = mapped[position : min(position + RUN_BLOCK_SIZE, end)]
+        yield from INDEX_ENTRY.iter_unpack(block)
+
+
+def write_index(
+    index_path: str,
+    entries: Iterable[Tuple[int, int]],
+    count: int,
+    stat: os.stat_result,
+    reference_key: str,
+) -> None:
+    # Write under a temporary name so readers never see a partial index
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(index_path))
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(
+                INDEX_HEADER.pack(
+                    INDEX_MAGIC,
+                    count,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    reference_key_tag(reference_key),
+                )
+            )
+            for entry in entries:
+                out.write(INDEX_ENTRY.pack(*entry))
+        os.replace(temp_path, index_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class MemoryTable:
+    """
+    Reference rows held in memory, indexed by the value of the reference key.
+
+    Rows are kept as encoded JSON, which is compact and read-only; each match is
+    decoded into fresh objects that the caller may modify. The first row with a
+    given key wins.
+    """
+
+    def __init__(
+        self, path: str, reference_key: str, fields: Optional[List[str]] = None
+    ):
+        self.rows: Dict[Any, str] = {}
+        for row in read_rows(path):
+            key = normalize_key(row.get(reference_key))
+            if key is not None and key not in self.rows:
+                self.rows[key] = json.dumps(select_fields(row, fields))
+
+    def get(self, value: Any) -> Optional[Dict[str, Any]]:
+        key = normalize_key(value)
+        if key is None:
+            return None
+        row = self.rows.get(key)
+        return json.loads(row) if row is not None else None
+
+
+class MappedTable:
+    """
+    Reference rows served from an NDJSON file through a memory-mapped hash index.
+
+    The index is a sorted array of (key hash, row offset) entries, written next to
+    the reference file and mapped read-only along with it, so memory use does not
+    grow with the table and worker processes using the same reference share both
+    through the page cache. Its header records the size and mtime of the file it
+    was built from, and it is rebuilt when they no longer match.
+    """
+
+    def __init__(
+        self, path: str, reference_key: str, fields: Optional[List[str]] = None
+    ):
+        self.reference_key = reference_key
+        self.fields = fields
+
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = b""
+        self.index = self.ensure_index(path, reference_key, stat)
+        self.count = INDEX_HEADER.unpack_from(self.index)[1]
+
+    @classmethod
+    def ensure_index(
+        cls, path: str, reference_key: str, stat: Optional[os.stat_result] = None
+    ) -> mmap.mmap:
+        """Map the index of path, building it first if it is missing or outdated."""
+        if is_json_array(path):
+            raise ValueError(f"mmap lookup index needs an NDJSON file: {path}")
+        if stat is None:
+            stat = os.stat(path)
+        index_path = cls.index_path(path, reference_key)
+        index = cls.open_index(index_path, stat, reference_key)
+        if index is None:
+            cls.build_index(path, reference_key, index_path)
+            index = cls.open_index(index_path, stat, reference_key)
+            if index is None:
+                raise ValueError(f"Reference file changed while indexing: {path}")
+        return index
+
+    @staticmethod
+    def index_path(path: str, reference_key: str) -> str:
+        path = os.path.abspath(path)
+        tag = reference_key_tag(reference_key).hex()
+        return os.path.join(
+            os.path.dirname(path), f"{os.path.basename(path)}.{tag}.idx"
+        )
+
+    @staticmethod
+    def open_index(
+        index_path: str, stat: os.stat_result, reference_key: str
+    ) -> Optional[mmap.mmap]:
+        """Map an index file, or return None if it is missing or out of date."""
+        try:
+            f = open(index_path, "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            if os.fstat(f.fileno()).st_size < INDEX_HEADER.size:
+                return None
+            index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, size, mtime_ns, tag = INDEX_HEADER.unpack_from(index)
+        if (
+            magic != INDEX_MAGIC
+            or (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns)
+            or tag != reference_key_tag(reference_key)
+            or len(index) != INDEX_HEADER.size + count * INDEX_ENTRY.size
+        ):
+            index.close()
+            return None
+        return index
+
+    @staticmethod
+    def build_index(path: str, reference_key: str, index_path: str) -> None:
+        directory = os.path.dirname(index_path)
+        with open(path, "rb") as f, tempfile.TemporaryFile(dir=directory) as runs:
+            stat = os.fstat(f.fileno())
+            # Entries are sorted in chunks of bounded size, which are spilled to
+            # runs and merged, so memory use does not grow with the table
+            bounds = []
+            chunk: List[Tuple[int, int]] = []
+            for entry in index_entries(f, reference_key):
+                chunk.append(entry)
+                if len(chunk) == INDEX_CHUNK_ENTRIES:
+                    bounds.append(write_run(runs, chunk))
+                    chunk = []
+            chunk.sort()
+            count = len(chunk) + sum(end - start for start, end in bounds) // (
+                INDEX_ENTRY.size
+            )
+            runs.flush()
+            mapped = (
+                mmap.mmap(runs.fileno(), 0, access=mmap.ACCESS_READ) if bounds else b""
+            )
+            try:
+                entries = heapq.merge(
+                    chunk, *(read_run(mapped, start, end) for start, end in bounds)
+                )
+                write_index(index_path, entries, count, stat, reference_key)
+            finally:
+                if bounds:
+                    mapped.close()
+
+    def get(self, value: Any) -> Optional[Dict[str, Any]]:
+        key = normalize_key(value)
+        if key is None:
+            return None
+        wanted = key_hash(key)
+
+        # Binary search for the first entry with the wanted hash
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry_hash, _ = INDEX_ENTRY.unpack_from(
+                self.index, INDEX_HEADER.size + middle * INDEX_ENTRY.size
+            )
+            if entry_hash < wanted:
+                low = middle + 1
+            else:
+                high = middle
+
+        # Entries with equal hashes are in file order, so the first row still wins
+        while low < self.count:
+            entry_hash, offset = INDEX_ENTRY.unpack_from(
+                self.index, INDEX_HEADER.size + low * INDEX_ENTRY.size
+            )
+            if entry_hash != wanted:
+                break
+            end = self.data.find(b"\n", offset)
+            row = json.loads(self.data[offset : end if end != -1 else len(self.data)])
+            if normalize_key(row.get(self.reference_key)) == key:
+                return select_fields(row, self.fields)
+            low += 1
+        return None
+
+
+def open_lookup_table(
+    path: str,
+    reference_key: str,
+    fields: Optional[List[str]] = None,
+    index: str = "memory",
+):
+    if index == "mmap":
+        return MappedTable(path, reference_key, fields)
+    return MemoryTable(path, reference_key, fields)
@@ -13,6 +13,11 @@ class TextModification(str, Enum):
     replace = "replace"
 
 
+class LookupIndex(str, Enum):
+    memory = "memory"
+    mmap = "mmap"
+
+
 class RenameTransformation(BaseModel):
     """Model for renaming keys or attributes"""
 
@@ -142,6 +147,19 @@ class ConcatTransformation(BaseModel):
     delimiter: Optional[str] = None
 
 
+class LookupTransformation(BaseModel):
+    """Model for enriching elements with fields from a reference table"""
+
+    type: Literal["lookup"] = "lookup"
+    path: str = "."
+    reference: str  # JSON array or NDJSON file of reference objects
+    key: str
+    reference_key: Optional[str] = None  # Defaults to key
+    fields: Optional[list[str]] = None  # Defaults to all fields
+    target: Optional[str] = None  # Merge into the element when not set
+    index: LookupIndex = LookupIndex.memory
+
+
 Transformation = Union[
     RenameTransformation,
     ReorderTransformation,
@@ -156,6 +174,7 @@ Transformation = Union[
     CopyStructureTransformation,
     GroupTransformation,
     ConcatTransformation,
+    LookupTransformation,
 ]
 
 
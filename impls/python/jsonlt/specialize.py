@@ -0,0 +1,582 @@
+# Specialize compiled plans against the known structure of their input
+
+import copy
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from .xform import apply_transformation, apply_transformations, thaw
+
+GUARD_TYPES = {"object": dict, "array": list, "string": str}
+
+TEXT_MODIFICATIONS = {
+    "uppercase": str.upper,
+    "lowercase": str.lower,
+    "capitalize": str.capitalize,
+    "title": str.title,
+    "strip": str.strip,
+}
+
+
+def schema_of(value: Any) -> Dict[str, Any]:
+    if isinstance(value, dict):
+        return {
+            "type": "object",
+            "properties": {key: schema_of(item) for key, item in value.items()},
+            "required": list(value),
+        }
+    if isinstance(value, list):
+        schema: Dict[str, Any] = {"type": "array"}
+        for item in value:
+            item_schema = schema_of(item)
+            schema["items"] = (
+                merge_schemas(schema["items"], item_schema)
+                if "items" in schema
+                else item_schema
+            )
+        return schema
+    if isinstance(value, str):
+        return {"type": "string"}
+    if isinstance(value, bool):
+        return {"type": "boolean"}
+    if isinstance(value, int):
+        return {"type": "integer"}
+    if isinstance(value, float):
+        return {"type": "number"}
+    if value is None:
+        return {"type": "null"}
+    return {}
+
+
+def merge_schemas(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the most specific schema that both left and right values satisfy."""
+    types = {left.get("type"), right.get("type")}
+    if types == {"integer", "number"}:
+        return {"type": "number"}
+    if len(types) != 1 or None in types:
+        return {}
+    if types == {"object"}:
+        properties = dict(left["properties"])
+        for key, schema in right["properties"].items():
+            properties[key] = (
+                merge_schemas(properties[key], schema) if key in properties else schema
+            )
+        required = [key for key in left["required"] if key in right["required"]]
+        return {"type": "object", "properties": properties, "required": required}
+    if types == {"array"}:
+        # An empty array says nothing about the items
+        if "items" in left and "items" in right:
+            return {
+                "type": "array",
+                "items": merge_schemas(left["items"], right["items"]),
+            }
+        return {"type": "array", "items": left.get("items", right.get("items", {}))}
+    return dict(left)
+
+
+def infer_schema(sample: Iterable[Any]) -> Dict[str, Any]:
+    """
+    Infer a JSON Schema satisfied by every record of a sample.
+
+    Keys present in all records are required, and a type is only given where
+    all records agree on it.
+    """
+    schema: Optional[Dict[str, Any]] = None
+    for record in sample:
+        record_schema = schema_of(record)
+        schema = (
+            record_schema if schema is None else merge_schemas(schema, record_schema)
+        )
+    return schema or {}
+
+
+class Facts:
+    """
+    What is known about a value at some point of a plan.
+
+    origin is the path of the value in the input record, with "[]" standing for
+    all items of an array, or None for values created by the plan itself.
+    """
+
+    def __init__(
+        self,
+        type: Optional[str] = None,
+        properties: Optional[Dict[str, "Facts"]] = None,
+        required: Iterable[str] = (),
+        items: Optional["Facts"] = None,
+        origin: Optional[Tuple[str, ...]] = None,
+    ):
+        self.type = type
+        self.properties = properties if properties is not None else {}
+        self.required = set(required)
+        self.items = items
+        self.origin = origin
+
+    @classmethod
+    def from_schema(cls, schema: Any, origin: Tuple[str, ...] = ()) -> "Facts":
+        if not isinstance(schema, Mapping):
+            return cls(origin=origin)
+        schema_type = schema.get("type")
+        if isinstance(schema_type, list):
+            schema_type = schema_type[0] if len(schema_type) == 1 else None
+        facts = cls(schema_type, origin=origin)
+        if schema_type == "object":
+            for key, item in schema.get("properties", {}).items():
+                facts.properties[key] = cls.from_schema(item, origin + (key,))
+            for key in schema.get("required", ()):
+                facts.required.add(key)
+                facts.properties.setdefault(key, cls(origin=origin + (key,)))
+        elif schema_type == "array" and "items" in schema:
+            facts.items = cls.from_schema(schema["items"], origin + ("[]",))
+        return facts
+
+    @classmethod
+    def from_value(cls, value: Any) -> "Facts":
+        """Facts about a value created by the plan, so with no origin in the input."""
+        facts = cls.from_schema(schema_of(value))
+        stack = [facts]
+        while stack:
+            current = stack.pop()
+            current.origin = None
+            stack.extend(current.properties.values())
+            if current.items is not None:
+                stack.append(current.items)
+        return facts
+
+    def set(self, key: str, facts: "Facts") -> None:
+        self.properties[key] = facts
+        self.required.add(key)
+
+    def pop(self, key: str) -> "Facts":
+        self.required.discard(key)
+        return self.properties.pop(key, Facts())
+
+
+class GuardNode:
+    def __init__(self):
+        self.types: set = set()
+        self.children: Dict[str, "GuardNode"] = {}
+        self.items: Optional["GuardNode"] = None
+
+
+def compile_guard(node: GuardNode) -> Callable[[Any], bool]:
+    """Turn a tree of input assumptions into a function checking them on a record."""
+    checks: List[Callable[[Any], bool]] = []
+    for type_name in node.types:
+        python_type = GUARD_TYPES[type_name]
+        checks.append(lambda value, t=python_type: isinstance(value, t))
+    for key, child in node.children.items():
+        child_check = compile_guard(child)
+        checks.append(
+            lambda value, k=key, c=child_check: isinstance(value, dict)
+            and k in value
+            and c(value[k])
+        )
+    if node.items is not None:
+        item_check = compile_guard(node.items)
+        checks.append(
+            lambda value, c=item_check: isinstance(value, list)
+            and all(c(item) for item in value)
+        )
+    if len(checks) == 1:
+        return checks[0]
+    return lambda value: all(check(value) for check in checks)
+
+
+class SpecializedPlan:
+    """
+    A compiled plan with the type checks proven unnecessary by an input schema dropped.
+
+    apply first runs a guard checking that a record has the structure the
+    specialized steps rely on; records failing it take the generic path and are
+    counted in fallbacks. Apart from the counters the plan is immutable, and it
+    can be shared between threads.
+    """
+
+    def __init__(
+        self,
+        plan: Tuple[Mapping[str, Any], ...],
+        steps: Tuple[Callable[[Any], Any], ...],
+        guard: Callable[[Any], bool],
+    ):
+        self.plan = plan
+        self.steps = steps
+        self.guard = guard
+        self.records = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def apply(self, json_data: Dict[str, Any]) -> Dict[str, Any]:
+        data = copy.deepcopy(json_data)
+        fallback = not self.guard(data)
+        if fallback:
+            data = apply_transformations(data, self.plan)
+        else:
+            for step in self.steps:
+                data = step(data)
+        with self._lock:
+            self.records += 1
+            self.fallbacks += fallback
+        return data
+
+
+def parse_path(path: str) -> Optional[Tuple[List[str], Optional[str]]]:
+    """
+    Split a path the way apply_path walks it into object keys and an array key.
+
+    Returns None for paths with array indexes, which are not specialized.
+    """
+    if path == ".":
+        return [], None
+    keys = []
+    for part in path.split(".")[1:]:
+        if part.endswith("[]"):
+            # apply_path stops at the first array, whatever follows
+            return keys, part[:-2]
+        if part.endswith("]"):
+            return None
+        keys.append(part)
+    return keys, None
+
+
+def navigator(
+    keys: List[str], items_key: Optional[str], func: Callable[[Any], Any]
+) -> Callable[[Any], Any]:
+    """Like apply_path, for a path whose objects and array are known to exist."""
+    if items_key is not None:
+
+        def step(root):
+            current = root
+            for key in keys:
+                current = current[key]
+            current[items_key] = [func(item) for item in current[items_key]]
+            return root
+
+    elif keys:
+        parents, last = keys[:-1], keys[-1]
+
+        def step(root):
+            current = root
+            for key in parents:
+                current = current[key]
+            current[last] = func(current[last])
+            return root
+
+    else:
+        step = func
+    return step
+
+
+FastFunction = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+class Specializer:
+    """Walks a plan, tracking what is known about the record after each step."""
+
+    def __init__(self, input_schema: Mapping[str, Any]):
+        self.root = Facts.from_schema(input_schema)
+        self.guard = GuardNode()
+        self.pending: List[Tuple[Tuple[str, ...], Optional[str]]] = []
+
+    def assume(self, facts: Facts, type_name: Optional[str] = None) -> None:
+        if facts.origin is not None:
+            self.pending.append((facts.origin, type_name))
+
+    def commit(self) -> None:
+        for origin, type_name in self.pending:
+            node = self.guard
+            for part in origin:
+                if part == "[]":
+                    if node.items is None:
+                        node.items = GuardNode()
+                    node = node.items
+                else:
+                    node = node.children.setdefault(part, GuardNode())
+            if type_name is not None:
+                node.types.add(type_name)
+        self.pending = []
+
+    def require(
+        self, facts: Facts, key: str, type_name: Optional[str] = None
+    ) -> Optional[Facts]:
+        """Return the facts of facts[key] if it surely exists with the given type."""
+        if facts.type != "object" or key not in facts.required:
+            return None
+        child = facts.properties[key]
+        if type_name is not None and child.type != type_name:
+            return None
+        self.assume(facts, "object")
+        self.assume(child, type_name)
+        return child
+
+    def resolve(self, keys: List[str], items_key: Optional[str]) -> Optional[Facts]:
+        """Return the facts of the object(s) a path leads to, if known to exist."""
+        current: Optional[Facts] = self.root
+        for key in keys:
+            current = self.require(current, key, "object")
+            if current is None:
+                return None
+        if items_key is not None:
+            array = self.require(current, items_key, "array")
+            if array is None or array.items is None or array.items.type != "object":
+                return None
+            self.assume(array.items, "object")
+            return array.items
+        if current.type != "object":
+            return None
+        self.assume(current, "object")
+        return current
+
+    def invalidate(self, keys: List[str], items_key: Optional[str]) -> None:
+        """
+        Forget what is known about the object(s) a generic step was applied to.
+
+        Only the origin is kept: the step changes what is at the path, not whether
+        it exists, so later steps relying on its presence still have it guarded.
+        """
+        parent = self.root
+        for key in keys[:-1] if items_key is None else keys:
+            if parent.type != "object" or key not in parent.required:
+                self.root = Facts(origin=self.root.origin)
+                return
+            parent = parent.properties[key]
+        if items_key is not None:
+            array = parent.properties.get(items_key)
+            if array is not None and array.type == "array":
+                if array.items is not None:
+                    array.items = Facts(origin=array.items.origin)
+            elif array is not None and parent.type == "object":
+                parent.properties[items_key] = Facts(origin=array.origin)
+        elif keys:
+            if parent.type == "object" and keys[-1] in parent.properties:
+                parent.properties[keys[-1]] = Facts(
+                    origin=parent.properties[keys[-1]].origin
+                )
+        else:
+            self.root = Facts(origin=self.root.origin)
+
+    def specialize_step(self, transformation: Mapping[str, Any]) -> Callable:
+        path = parse_path(transformation.get("path", "."))
+        facts = self.resolve(*path) if path is not None else None
+        func = self.fast_function(transformation, facts) if facts is not None else None
+        if func is not None:
+            self.commit()
+            return navigator(path[0], path[1], func)
+
+        self.pending = []
+        if path is None:
+            self.root = Facts(origin=self.root.origin)
+        else:
+            self.invalidate(*path)
+        return lambda data: apply_transformation(data, transformation)
+
+    def fast_function(
+        self, transformation: Mapping[str, Any], facts: Facts
+    ) -> Optional[FastFunction]:
+        """
+        Return a check-free version of transformation for objects with these facts.
+
+        Updates facts to describe the objects after the step. Returns None when
+        the checks cannot be proven unnecessary, leaving facts untouched.
+        """
+        builder = FAST_FUNCTIONS.get(transformation["type"])
+        return builder(self, transformation, facts) if builder is not None else None
+
+
+def fast_add(
+    specializer: Specializer, transformation: Mapping[str, Any], facts: Facts
+) -> Optional[FastFunction]:
+    target, value = transformation["target"], transformation["value"]
+    facts.set(target, Facts.from_value(thaw(value)))
+
+    def add(data):
+        data[target] = thaw(value)
+        return data
+
+    return add
+
+
+def fast_rename(
+    specializer: Specializer, transformation: Mapping[str, Any], facts: Facts
+) -> Optional[FastFunction]:
+    source, target = transformation["source"], transformation["target"]
+    if specializer.require(facts, source) is None:
+        return None
+    facts.set(target, facts.pop(source))
+
+    def rename(data):
+        data[target] = data.pop(source)
+        return data
+
+    return rename
+
+
+def fast_remove(
+    specializer: Specializer, transformation: Mapping[str, Any], facts: Facts
+) -> Optional[FastFunction]:
+    target = transformation["target"]
+    if specializer.require(facts, target) is None:
+        return None
+    facts.pop(target)
+
+    def remove(data):
+        del data[target]
+        return data
+
+    return remove
+
+
+def fast_attribute_to_element(
+    specializer: Specializer, transformation: Mapping[str, Any], facts: Facts
+) -> Optional[FastFunction]:
+    source, target = transformation["source"], transformation["target"]
+    if specializer.require(facts, source) is None:
+        return None
+    wrapped = Facts("object")
+    wrapped.set(source, facts.pop(source))
+    facts.set(target, wrapped)
+
+    def attribute_to_element(data):
+        data[target] = {source: data.pop(source)}
+        return data
+
+    return attribute_to_element
+
+
+def fast_element_to_attribute(
+    specializer: Specializer, transformation: Mapping[str, Any], facts: Facts
+) -> Optional[FastFunction]:
+    source_parts = transformation["source"].split(".")
+    target = transformation["target"]
+    if len(source_parts) != 2:
+        return None
+    element, attribute = source_parts
+    element_facts = specializer.require(facts, element, "object")
+    if element_facts is None or specializer.require(element_facts, attribute) is None:
+        return None
+    facts.set(target, element_facts.properties[attribute])
+    facts.pop(element)
+
+    def element_to_attribute(data):
+        data[target] = data[element][attribute]
+        del data[element]
+        return data
+
+    return element_to_attribute
+
+
+def fast_modify_text(
+    specializer: Specializer, transformation: Mapping[str, Any], facts: Facts
+) -> Optional[FastFunction]:
+    target = transformation["target"]
+    modification = getattr(
+        transformation["modification"], "value", transformation["modification"]
+    )
+    if modification == "replace":
+        old, new = transformation["replace_old"], transformation["replace_new"]
+        if old is None or new is None:
+            return None
+
+        def modify(text):
+            return text.replace(old, new)
+
+    else:
+        modify = TEXT_MODIFICATIONS[modification]
+    if specializer.require(facts, target, "string") is None:
+        return None
+
+    def modify_text(data):
+        data[target] = modify(data[target])
+        return data
+
+    return modify_text
+
+
+def fast_concat(
+    specializer: Specializer, transformation: Mapping[str, Any], facts: Facts
+) -> Optional[FastFunction]:
+    sources, target = transformation["sources"], transformation["target"]
+    delimiter = transformation["delimiter"]
+    joiner = delimiter if delimiter is not None else ""
+    if not sources or any(
+        specializer.require(facts, source) is None for source in sources
+    ):
+        return None
+    facts.set(target, Facts("string"))
+
+    def concat(data):
+        data[target] = joiner.join([str(data[source]) for source in sources])
+        return data
+
+    return concat
+
+
+def fast_reorder(
+    specializer: Specializer, transformation: Mapping[str, Any], facts: Facts
+) -> Optional[FastFunction]:
+    order = transformation["order"]
+    if any(specializer.require(facts, key) is None for key in order):
+        return None
+    facts.properties = {key: facts.properties[key] for key in order}
+    facts.required = set(order)
+
+    def reorder(data):
+        return {key: data[key] for key in order}
+
+    return reorder
+
+
+def fast_group(
+    specializer: Specializer, transformation: Mapping[str, Any], facts: Facts
+) -> Optional[FastFunction]:
+    source, target = transformation["source"], transformation["target"]
+    group_by = transformation["group_by"]
+    array = specializer.require(facts, source, "array")
+    if (
+        array is None
+        or array.items is None
+        or specializer.require(array.items, group_by) is None
+    ):
+        return None
+    facts.pop(source)
+    facts.set(target, Facts("object"))
+
+    def group(data):
+        grouped: Dict[Any, List[Any]] = {}
+        for item in data[source]:
+            grouped.setdefault(item[group_by], []).append(item)
+        data[target] = grouped
+        del data[source]
+        return data
+
+    return group
+
+
+# Builders of the check-free version of each transformation type, see fast_function
+FAST_FUNCTIONS: Dict[str, Callable[..., Optional[FastFunction]]] = {
+    "add": fast_add,
+    "rename": fast_rename,
+    "remove": fast_remove,
+    "attribute_to_element": fast_attribute_to_element,
+    "element_to_attribute": fast_element_to_attribute,
+    "modify_text": fast_modify_text,
+    "concat": fast_concat,
+    "reorder": fast_reorder,
+    "group": fast_group,
+}
+
+
+def specialize_plan(
+    plan: Tuple[Mapping[str, Any], ...], input_schema: Mapping[str, Any]
+) -> SpecializedPlan:
+    """
+    Specialize a plan made by compile_jsonlt for input satisfying input_schema.
+
+    Steps whose membership and type checks the schema proves unnecessary are
+    replaced by versions without them; the rest, and every step after a
+    conditional, merge, split, copy_structure or lookup has changed an object
+    in ways that are not tracked, keep the generic implementation at that path.
+    input_schema may be a JSON Schema or one returned by infer_schema.
+    """
+    specializer = Specializer(input_schema)
+    steps = tuple(specializer.specialize_step(step) for step in plan)
+    return SpecializedPlan(plan, steps, compile_guard(specializer.guard))
@@ -0,0 +1,467 @@
+import copy
+import json
+import os
+import sys
+
+import pytest
+from gold_file import find_testfiles_folder
+
+from jsonlt import (
+    ShapeCache,
+    apply,
+    compile,
+    infer_schema,
+    specialize,
+    transform,
+    transform_fanout,
+    transform_many,
+)
+from jsonlt import cli, lookup
+from jsonlt.xform import apply_transformations
+
+
+def load_test_cases():
+    test_folder = find_testfiles_folder()
+    test_cases = []
+    for filename in sorted(os.listdir(test_folder)):
+        if filename.endswith(".json"):
+            with open(os.path.join(test_folder, filename), "r") as file:
+                test_cases.append(json.load(file))
+    return test_cases
+
+
+def test_fanout_matches_individual_runs():
+    for test_case in load_test_cases():
+        conf = test_case["jsonlt"]
+        steps = conf["transformations"]
+        # Identical, prefix and diverging configurations over the same input
+        confs = [
+            conf,
+            conf,
+            {"transformations": steps[:1]},
+            {"transformations": []},
+            {"transformations": steps + [{"type": "add", "target": "x", "value": 1}]},
+        ]
+        results = transform_fanout(test_case["input"], confs)
+
+        assert results[0] == test_case["output"]
+        for result, jsonlt_conf in zip(results, confs):
+            assert result == transform(test_case["input"], jsonlt_conf)
+        assert results[0] is not results[1]
+
+
+def test_fanout_does_not_modify_input():
+    data = {"person": {"firstName": "John"}}
+    confs = [
+        {
+            "transformations": [
+                {"type": "remove", "path": ".person", "target": "firstName"}
+            ]
+        },
+        {
+            "transformations": [
+                {"type": "add", "path": ".person", "target": "age", "value": 3}
+            ]
+        },
+    ]
+    results = transform_fanout(data, confs)
+
+    assert data == {"person": {"firstName": "John"}}
+    assert results == [{"person": {}}, {"person": {"firstName": "John", "age": 3}}]
+
+
+def test_cli_fanout_writes_one_output_per_config(tmp_path, monkeypatch):
+    data = {"name": "ann", "age": 3}
+    configs = [
+        {"transformations": [{"type": "rename", "source": "name", "target": "n"}]},
+        {"transformations": [{"type": "remove", "target": "age"}]},
+    ]
+    (tmp_path / "input.json").write_text(json.dumps(data))
+    argv = ["jsonlt", str(tmp_path / "input.json")]
+    for i, config in enumerate(configs):
+        (tmp_path / f"config{i}.json").write_text(json.dumps(config))
+        argv += [
+            "--config",
+            f"{tmp_path / f'config{i}.json'}:{tmp_path / f'out{i}.json'}",
+        ]
+    monkeypatch.setattr(sys, "argv", argv)
+
+    cli.main()
+
+    for i, config in enumerate(configs):
+        output = json.loads((tmp_path / f"out{i}.json").read_text())
+        assert output == transform(data, config)
+
+
+@pytest.mark.parametrize(
+    "extra",
+    [["config.json"], ["-o", "out.json"], ["--config", "no-output.json"]],
+)
+def test_cli_fanout_rejects_invalid_arguments(monkeypatch, capsys, extra):
+    argv = ["jsonlt", "input.json", "--config", "a.json:out_a.json", *extra]
+    monkeypatch.setattr(sys, "argv", argv)
+
+    with pytest.raises(SystemExit) as exc_info:
+        cli.main()
+
+    assert exc_info.value.code == 2
+    assert "--config" in capsys.readouterr().err
+
+
+def test_shape_cache_matches_generic_path():
+    shape_cache = ShapeCache()
+    for test_case in load_test_cases():
+        result = transform(test_case["input"], test_case["jsonlt"], shape_cache)
+        assert result == test_case["output"]
+
+
+def test_shape_cache_reuses_plans_for_records_of_the_same_shape():
+    shape_cache = ShapeCache()
+    records = [{"id": i, "first": "a", "last": "b", "tmp": i} for i in range(10)]
+    records.append({"first": "a", "id": 10})
+    conf = {
+        "transformations": [
+            {
+                "type": "rename",
+                "path": ".items[]",
+                "source": "first",
+                "target": "given",
+            },
+            {"type": "remove", "path": ".items[]", "target": "tmp"},
+            {
+                "type": "attribute_to_element",
+                "path": ".items[]",
+                "source": "id",
+                "target": "key",
+            },
+            {
+                "type": "concat",
+                "path": ".items[]",
+                "sources": ["given", "last"],
+                "target": "name",
+                "delimiter": " ",
+            },
+            {"type": "reorder", "path": ".items[]", "order": ["name", "key", "last"]},
+        ]
+    }
+
+    result = transform({"items": records}, conf, shape_cache)
+
+    assert result == transform({"items": records}, conf)
+    assert result["items"][0] == {"name": "a b", "key": {"id": 0}, "last": "b"}
+    assert result["items"][10] == {"name": "a", "key": {"id": 10}}
+    info = shape_cache.info()
+    assert info.misses == 2
+    assert info.hits == 9
+    assert info.currsize == 2
+
+
+def test_shape_cache_reuses_runs_across_compilations():
+    shape_cache = ShapeCache()
+    conf = {"transformations": [{"type": "reorder", "order": ["b", "a"]}]}
+
+    transform({"a": 1, "b": 2}, conf, shape_cache)
+    result = transform({"a": 3, "b": 4}, conf, shape_cache)
+
+    assert list(result) == ["b", "a"]
+    assert shape_cache.info() == (1, 1, 1024, 1)
+
+
+def test_shape_cache_evicts_least_recently_used():
+    cache = ShapeCache(maxsize=2)
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: None)
+    cache.get("c", lambda: 3)
+
+    assert cache.get("a", lambda: None) == 1
+    assert cache.get("b", lambda: None) is None
+    assert cache.info() == (2, 4, 2, 2)
+
+
+def test_compiled_plan_is_immutable():
+    conf = {"transformations": [{"type": "add", "target": "tags", "value": ["a"]}]}
+    plan = compile(conf)
+
+    with pytest.raises(TypeError):
+        plan[0]["target"] = "other"
+    with pytest.raises(AttributeError):
+        plan[0]["value"].append("b")
+
+    results = transform_many([{}, {}], conf, "threads")
+    results[0]["tags"].append("b")
+    assert results == [{"tags": ["a", "b"]}, {"tags": ["a"]}]
+
+
+def test_threads_sharing_one_plan_match_sequential_results():
+    for test_case in load_test_cases():
+        records = [copy.deepcopy(test_case["input"]) for _ in range(200)]
+        shape_cache = ShapeCache(maxsize=4)
+        results = transform_many(
+            records,
+            test_case["jsonlt"],
+            backend="threads",
+            max_workers=32,
+            shape_cache=shape_cache,
+        )
+
+        assert results == [test_case["output"]] * len(records)
+        assert records[0] == test_case["input"]
+
+
+def test_processes_backend():
+    test_case = load_test_cases()[0]
+    results = transform_many([test_case["input"]] * 3, test_case["jsonlt"], "processes")
+
+    assert results == [test_case["output"]] * 3
+    with pytest.raises(ValueError):
+        transform_many([], test_case["jsonlt"], "processes", shape_cache=ShapeCache())
+    with pytest.raises(FileNotFoundError):
+        missing = {"type": "lookup", "reference": "missing.json", "key": "id"}
+        transform_many([], {"transformations": [missing]}, "processes")
+
+
+@pytest.mark.parametrize("index", ["memory", "mmap"])
+def test_lookup_attaches_matching_reference_rows(tmp_path, index):
+    reference = tmp_path / "departments.ndjson"
+    reference.write_text(
+        '{"code": "eng", "name": "Engineering", "floor": 3}\n'
+        "\n"
+        '{"code": "ops", "name": "Operations", "floor": 1}\n'
+        '{"code": "eng", "name": "Duplicate", "floor": 9}'
+    )
+    conf = {
+        "transformations": [
+            {
+                "type": "lookup",
+                "path": ".employees[]",
+                "reference": str(reference),
+                "key": "dept",
+                "reference_key": "code",
+                "fields": ["name"],
+                "target": "department",
+                "index": index,
+            },
+            {
+                "type": "lookup",
+                "path": ".employees[]",
+                "reference": str(reference),
+                "key": "dept",
+                "reference_key": "code",
+                "index": index,
+            },
+        ]
+    }
+    data = {"employees": [{"dept": "eng"}, {"dept": "hr"}, {"dept": ["eng"]}]}
+
+    results = transform_many([data] * 4, conf, "threads")
+
+    assert (
+        results
+        == [
+            {
+                "employees": [
+                    {
+                        "dept": "eng",
+                        "department": {"name": "Engineering"},
+                        "code": "eng",
+                        "name": "Engineering",
+                        "floor": 3,
+                    },
+                    {"dept": "hr"},
+                    {"dept": ["eng"]},
+                ]
+            }
+        ]
+        * 4
+    )
+    assert results[0]["employees"][0]["department"] is not (
+        results[1]["employees"][0]["department"]
+    )
+    assert transform_many([data] * 4, conf, "processes", max_workers=2) == results
+
+
+@pytest.mark.parametrize("index", ["memory", "mmap"])
+@pytest.mark.parametrize(
+    "value, label",
+    [(1, "one"), (1.0, "one"), (2.5, "half"), (True, None), ("1", "text")],
+)
+def test_lookup_keys_match_the_same_in_both_indexes(tmp_path, index, value, label):
+    reference = tmp_path / "codes.ndjson"
+    reference.write_text(
+        '{"id": true, "label": "bool"}\n'
+        '{"id": 1.0, "label": "one"}\n'
+        '{"id": 2.5, "label": "half"}\n'
+        '{"id": "1", "label": "text"}\n'
+    )
+    conf = {
+        "transformations": [
+            {"type": "lookup", "reference": str(reference), "key": "id", "index": index}
+        ]
+    }
+
+    result = transform({"id": value}, conf)
+
+    assert result.get("label") == label
+
+
+def test_mmap_index_is_kept_next_to_reference_and_rebuilt(tmp_path):
+    reference = tmp_path / "codes.ndjson"
+    reference.write_text('{"id": 1, "label": "one"}\n')
+    conf = {
+        "transformations": [
+            {
+                "type": "lookup",
+                "reference": str(reference),
+                "key": "id",
+                "index": "mmap",
+            }
+        ]
+    }
+
+    assert transform({"id": 1}, conf) == {"id": 1, "label": "one"}
+    assert len(list(tmp_path.glob("codes.ndjson.*.idx"))) == 1
+
+    reference.write_text('{"id": 1, "label": "uno"}\n{"id": 2, "label": "dos"}\n')
+    os.utime(reference, ns=(0, 0))
+
+    assert transform({"id": 1}, conf) == {"id": 1, "label": "uno"}
+    assert transform({"id": 2}, conf) == {"id": 2, "label": "dos"}
+    assert len(list(tmp_path.glob("codes.ndjson.*.idx"))) == 1
+
+
+def test_mmap_index_merges_sorted_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(lookup, "INDEX_CHUNK_ENTRIES", 3)
+    reference = tmp_path / "codes.ndjson"
+    rows = [{"id": i % 7, "label": str(i)} for i in range(20)]
+    reference.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    conf = {
+        "transformations": [
+            {
+                "type": "lookup",
+                "reference": str(reference),
+                "key": "id",
+                "index": "mmap",
+            }
+        ]
+    }
+    plan = compile(conf)
+
+    results = [apply({"id": i}, plan) for i in range(8)]
+
+    assert results == [{"id": i, "label": str(i)} for i in range(7)] + [{"id": 7}]
+
+
+def test_lookup_tables_are_loaded_once_per_plan(tmp_path):
+    reference = tmp_path / "codes.json"
+    reference.write_text('[{"id": 1, "label": "one"}, {"id": 2, "label": "two"}]')
+    lookup = {"type": "lookup", "reference": str(reference), "key": "id"}
+    conf = {
+        "transformations": [
+            lookup,
+            {"type": "copy_structure", "modifications": [lookup]},
+        ]
+    }
+
+    plan = compile(conf)
+
+    assert plan[0]["table"] is plan[1]["modifications"][0]["table"]
+    assert [apply({"id": key}, plan) for key in (1, 2)] == [
+        {"id": 1, "label": "one"},
+        {"id": 2, "label": "two"},
+    ]
+    assert transform({"id": 2}, conf) == {"id": 2, "label": "two"}
+    with pytest.raises(ValueError):
+        compile({"transformations": [{**lookup, "index": "mmap"}]})
+    with pytest.raises(ValueError, match="compile_jsonlt"):
+        apply_transformations({"id": 2}, [lookup])
+
+
+def test_specialized_plans_match_generic_path():
+    for test_case in load_test_cases():
+        plan = specialize(
+            compile(test_case["jsonlt"]), infer_schema([test_case["input"]])
+        )
+
+        assert plan.apply(test_case["input"]) == test_case["output"]
+        assert (plan.records, plan.fallbacks) == (1, 0)
+
+
+def test_specialized_plan_falls_back_on_mismatching_records():
+    schema = {
+        "type": "object",
+        "properties": {
+            "people": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"name": {"type": "string"}},
+                    "required": ["name"],
+                },
+            }
+        },
+        "required": ["people"],
+    }
+    conf = {
+        "transformations": [
+            {
+                "type": "modify_text",
+                "path": ".people[]",
+                "target": "name",
+                "modification": "uppercase",
+            },
+            {"type": "rename", "path": ".people[]", "source": "name", "target": "n"},
+        ]
+    }
+    plan = specialize(compile(conf), schema)
+    records = [
+        {"people": [{"name": "ann"}, {"name": "bob"}]},
+        {"people": [{"name": "ann"}, {"name": 7}]},
+        {"people": [{"name": "ann"}, {}]},
+        {"folks": []},
+    ]
+
+    results = [plan.apply(record) for record in records]
+
+    assert results == [transform(record, conf) for record in records]
+    assert (plan.records, plan.fallbacks) == (4, 3)
+
+
+def test_specialized_plan_falls_back_after_generic_step():
+    schema = {
+        "type": "object",
+        "properties": {"a": {"type": "object"}},
+        "required": ["a"],
+    }
+    conf = {
+        "transformations": [
+            {"type": "merge", "path": ".a", "sources": ["x"], "target": "y"},
+            {"type": "rename", "source": "a", "target": "e"},
+        ]
+    }
+    plan = specialize(compile(conf), schema)
+    records = [{"a": {"x": 1}}, {}]
+
+    results = [plan.apply(record) for record in records]
+
+    assert results == [transform(record, conf) for record in records]
+    assert (plan.records, plan.fallbacks) == (2, 1)
+
+
+def test_infer_schema_keeps_only_what_all_records_share():
+    schema = infer_schema(
+        [{"a": 1, "b": "x", "c": []}, {"a": 1.5, "b": None, "c": [{}]}]
+    )
+
+    assert schema == {
+        "type": "object",
+        "properties": {
+            "a": {"type": "number"},
+            "b": {},
+            "c": {
+                "type": "array",
+                "items": {"type": "object", "properties": {}, "required": []},
+            },
+        },
+        "required": ["a", "b", "c"],
+    }
@@ -2,9 +2,29 @@
 
 import copy
 import operator
+import os
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from functools import reduce
-from typing import Any, Callable, Dict, List, Optional, Union
-
+from types import MappingProxyType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from .lookup import MappedTable, open_lookup_table
 from .schema_gen import JSONLT, Condition
 
 
@@ -259,6 +279,244 @@ def concat_transformation(
     return data
 
 
+def lookup_transformation(
+    data: Dict[str, Any], table: Any, key: str, target: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Attach the reference row matching data[key] from a lookup table.
+
+    The row is stored under target, or merged into data when no target is given.
+    Elements without a matching row are left unchanged.
+    """
+    if key in data:
+        row = table.get(data[key])
+        if row is not None:
+            if target is not None:
+                data[target] = row
+            else:
+                data.update(row)
+    return data
+
+
+ShapeCacheInfo = namedtuple("ShapeCacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+# Placeholder for a concat result inside a shape plan
+ConcatSlot = namedtuple("ConcatSlot", ["delimiter", "parts"])
+
+# Transformations that only move, wrap or join values without inspecting them
+SHAPED_TYPES = ("rename", "reorder", "remove", "attribute_to_element", "concat")
+
+# Number of plans a ShapeCache remembers the split into runs for
+SPLIT_CACHE_SIZE = 64
+
+
+class ShapeCache:
+    """
+    Bounded LRU cache of key-mapping plans, keyed by transformations and record shape.
+
+    The shape of a record is the tuple of its keys. In a stream of records nearly
+    all share one shape, so the plan saying where each value ends up is computed
+    for the first record of a shape and reused for the rest.
+
+    Looking up the shape costs about as much as the key tests it saves on narrow
+    records, so the cache pays off when reorder lists are long compared to the
+    records they are applied to, e.g. one order covering several record types.
+
+    A cache can be shared between threads. Inserts are serialized by a lock, hits
+    are not, so under contention the hit count is approximate.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._plans: OrderedDict = OrderedDict()
+        self._splits: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, build: Callable[..., Any], *args: Any) -> Any:
+        # Hits go without the lock: single dict operations are atomic, and a key
+        # evicted between the two calls is simply built again
+        try:
+            plan = self._plans[key]
+            self._plans.move_to_end(key)
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return plan
+        # Build outside the lock; two threads missing on one shape build equal plans
+        plan = build(*args)
+        with self._lock:
+            self.misses += 1
+            self._plans[key] = plan
+            if len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        return plan
+
+    def split(self, transformations: Sequence[Mapping[str, Any]]) -> Tuple[Any, ...]:
+        """
+        Return transformations with the runs to apply through the cache grouped.
+
+        A run of consecutive SHAPED_TYPES transformations on the same path that
+        includes a reorder becomes a ShapeRun. Reorder rebuilds each record anyway,
+        so the rest of the run comes at the cost of that one rebuild; runs without
+        a reorder are cheaper to apply in place. The split is remembered for the
+        last few plans, which are expected not to change once compiled.
+        """
+        # Plans are read on every record, so this read goes without the lock
+        entry = self._splits.get(id(transformations))
+        if entry is not None and entry[0] is transformations:
+            return entry[1]
+
+        with self._lock:
+            # A plan compiled again from the same config reuses the runs already
+            # made for it, along with the shape plans cached for those runs
+            for plan, segments in self._splits.values():
+                if plan == transformations:
+                    break
+            else:
+                segments = self.split_runs(transformations)
+            # Holding on to the plan keeps its id from being reused while cached
+            self._splits[id(transformations)] = (transformations, segments)
+            if len(self._splits) > SPLIT_CACHE_SIZE:
+                self._splits.popitem(last=False)
+        return segments
+
+    @staticmethod
+    def split_runs(transformations: Sequence[Mapping[str, Any]]) -> Tuple[Any, ...]:
+        segments: List[Any] = []
+        i = 0
+        while i < len(transformations):
+            path = transformations[i].get("path", ".")
+            j = i
+            while (
+                j < len(transformations)
+                and transformations[j]["type"] in SHAPED_TYPES
+                and transformations[j].get("path", ".") == path
+            ):
+                j += 1
+            if any(
+                transformation["type"] == "reorder"
+                for transformation in transformations[i:j]
+            ):
+                segments.append(ShapeRun(path, list(transformations[i:j])))
+                i = j
+            else:
+                segments.append(transformations[i])
+                i += 1
+        return tuple(segments)
+
+    def info(self) -> ShapeCacheInfo:
+        with self._lock:
+            return ShapeCacheInfo(
+                self.hits, self.misses, self.maxsize, len(self._plans)
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._plans.clear()
+            self._splits.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class ShapeRun:
+    """
+    A run of SHAPED_TYPES transformations applied together through a ShapeCache.
+
+    Runs are made once per plan by ShapeCache.split and compare by identity, so
+    looking one up again for every record costs no more than hashing the shape.
+    """
+
+    __slots__ = ("path", "transformations")
+
+    def __init__(self, path: str, transformations: List[Mapping[str, Any]]):
+        self.path = path
+        self.transformations = transformations
+
+    def __iter__(self):
+        return iter(self.transformations)
+
+
+def build_shape_plan(
+    shape: Tuple[str, ...], run: List[Dict[str, Any]]
+) -> Tuple[Tuple[str, ...], Tuple[Any, ...], Callable]:
+    """
+    Work out how a run of transformations rearranges a record with the given shape.
+
+    The transformations are run on a stand-in record whose values are the
+    positions of its keys. Values that are not simply moved (objects created by
+    attribute_to_element and concat results) become extra slots appended after
+    the record's own values. The plan is the output keys, those extra slots and
+    a getter picking the output values from the extended value list.
+    """
+    template: Dict[str, Any] = {key: i for i, key in enumerate(shape)}
+    for transformation in run:
+        if transformation["type"] == "concat":
+            parts = tuple(
+                template[source]
+                for source in transformation["sources"]
+                if source in template
+            )
+            if parts:
+                delimiter = transformation.get("delimiter")
+                template[transformation["target"]] = ConcatSlot(
+                    delimiter if delimiter is not None else "", parts
+                )
+        else:
+            template = apply_transformation(template, {**transformation, "path": "."})
+
+    extra_slots = []
+    positions = []
+    for slot in template.values():
+        if isinstance(slot, int):
+            positions.append(slot)
+        else:
+            positions.append(len(shape) + len(extra_slots))
+            extra_slots.append(compile_slot(slot))
+    if len(positions) > 1:
+        getter = operator.itemgetter(*positions)
+    else:
+        getter = lambda values: tuple(values[i] for i in positions)  # noqa: E731
+    return tuple(template), tuple(extra_slots), getter
+
+
+def compile_slot(slot: Any) -> Callable[[List[Any]], Any]:
+    """Turn a shape plan slot into a function computing it from the record values."""
+    if isinstance(slot, int):
+        return operator.itemgetter(slot)
+    if isinstance(slot, dict):
+        parts = [(key, compile_slot(part)) for key, part in slot.items()]
+        return lambda values: {key: part(values) for key, part in parts}
+    parts = [compile_slot(part) for part in slot.parts]
+    delimiter = slot.delimiter
+    return lambda values: delimiter.join([str(part(values)) for part in parts])
+
+
+def apply_shaped(
+    data: Dict[str, Any], run: ShapeRun, shape_cache: ShapeCache
+) -> Dict[str, Any]:
+    """
+    Apply a run of SHAPED_TYPES transformations in one pass over a record.
+
+    The run and the record shape select a plan from shape_cache, and the record
+    is rebuilt by copying values by position.
+    """
+    if not isinstance(data, dict):
+        for transformation in run:
+            data = apply_transformation(data, {**transformation, "path": "."})
+        return data
+    shape = tuple(data)
+    keys, extra_slots, getter = shape_cache.get(
+        (run, shape), build_shape_plan, shape, run
+    )
+    values = list(data.values())
+    for slot in extra_slots:
+        values.append(slot(values))
+    return dict(zip(keys, getter(values)))
+
+
 def apply_path(
     data: Dict[str, Any], path: str, transformation_func: Callable
 ) -> Dict[str, Any]:
@@ -344,7 +602,7 @@ def apply_transformation(
             ),
         )
     elif transformation_type == "conditional":
-        condition = Condition(**transformation["condition"])
+        condition = Condition(**thaw(transformation["condition"]))
         return apply_path(
             data,
             path,
@@ -376,7 +634,7 @@ def apply_transformation(
             data,
             path,
             lambda x: add_element_transformation(
-                x, transformation["target"], transformation["value"]
+                x, transformation["target"], thaw(transformation["value"])
             ),
         )
     elif transformation_type == "remove":
@@ -425,18 +683,296 @@ def apply_transformation(
                 transformation.get("delimiter"),
             ),
         )
+    elif transformation_type == "lookup":
+        table = transformation.get("table")
+        if table is None:
+            # Loading the reference here would repeat it for every call
+            raise ValueError(
+                "lookup transformations need their reference table loaded, "
+                "apply them through a plan from compile_jsonlt"
+            )
+        return apply_path(
+            data,
+            path,
+            lambda x: lookup_transformation(
+                x, table, transformation["key"], transformation.get("target")
+            ),
+        )
     return data
 
 
-def jsonlt_transform(
-    json_data: Dict[str, Any], jsonlt_conf: Dict[str, Any]
+def apply_transformations(
+    data: Dict[str, Any],
+    transformations: List[Dict[str, Any]],
+    shape_cache: Optional[ShapeCache] = None,
 ) -> Dict[str, Any]:
-    transformed_data = copy.deepcopy(json_data)
-    jsonlt = JSONLT(**jsonlt_conf)
+    """
+    Apply a list of transformations in order.
+
+    With a shape_cache, the runs picked by ShapeCache.split are applied through
+    the cache, rebuilding each record at their path once.
+    """
+    if shape_cache is None:
+        for transformation in transformations:
+            data = apply_transformation(data, transformation)
+        return data
+
+    for segment in shape_cache.split(transformations):
+        if isinstance(segment, ShapeRun):
+            if segment.path == ".":
+                data = apply_shaped(data, segment, shape_cache)
+            else:
+                data = apply_path(
+                    data,
+                    segment.path,
+                    lambda x, run=segment: apply_shaped(x, run, shape_cache),
+                )
+        else:
+            data = apply_transformation(data, segment)
+    return data
+
+
+def freeze(value: Any) -> Any:
+    """Return a read-only copy of value: dicts become mapping proxies, lists tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Return a fresh mutable copy of a value made by freeze."""
+    if isinstance(value, MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+def iter_lookups(transformation: Mapping[str, Any]) -> Iterator[Mapping[str, Any]]:
+    """Yield the lookup transformations in a transformation, including nested ones."""
+    transformation_type = transformation["type"]
+    if transformation_type == "lookup":
+        yield transformation
+    elif transformation_type == "conditional":
+        for branch in ("true_transformation", "false_transformation"):
+            if transformation[branch] is not None:
+                yield from iter_lookups(transformation[branch])
+    elif transformation_type == "copy_structure":
+        for modification in transformation["modifications"]:
+            yield from iter_lookups(modification)
+
 
-    for transformation in jsonlt.transformations:
-        transformed_data = apply_transformation(
-            transformed_data, transformation.model_dump()
+def bind_lookup_tables(
+    transformation: Dict[str, Any], lookup_tables: Dict[Any, Any]
+) -> Dict[str, Any]:
+    """
+    Open the reference table of each lookup transformation, including nested ones.
+
+    Tables are stored under "table" in the transformation and shared through
+    lookup_tables by all lookups on the same file, key, fields and index type.
+    """
+    for lookup in iter_lookups(transformation):
+        reference_key = lookup["reference_key"] or lookup["key"]
+        fields = lookup["fields"]
+        table_key = (
+            os.path.abspath(lookup["reference"]),
+            reference_key,
+            tuple(fields) if fields is not None else None,
+            lookup["index"],
         )
+        if table_key not in lookup_tables:
+            lookup_tables[table_key] = open_lookup_table(
+                lookup["reference"], reference_key, fields, lookup["index"]
+            )
+        lookup["table"] = lookup_tables[table_key]
+    return transformation
 
-    return transformed_data
+
+def compile_jsonlt(
+    jsonlt_conf: Dict[str, Any], lookup_tables: Optional[Dict[Any, Any]] = None
+) -> Tuple[Mapping[str, Any], ...]:
+    """
+    Validate a JSONLT configuration and return its transformations as a plan.
+
+    The plan is deeply immutable, so one plan can be applied any number of times
+    and shared between threads. Values that end up in the output, such as those
+    of add transformations, are copied out of the plan each time they are used.
+    Reference tables of lookup transformations are loaded once per plan, or once
+    per lookup_tables dict when one is passed in for several plans.
+    """
+    return tuple(
+        freeze(transformation)
+        for transformation in bind_plan(jsonlt_conf, lookup_tables or {})
+    )
+
+
+def bind_plan(
+    jsonlt_conf: Dict[str, Any], lookup_tables: Dict[Any, Any]
+) -> List[Dict[str, Any]]:
+    """Validate a JSONLT configuration and return its transformations, unfrozen."""
+    jsonlt = JSONLT(**jsonlt_conf)
+    return [
+        bind_lookup_tables(transformation.model_dump(), lookup_tables)
+        for transformation in jsonlt.transformations
+    ]
+
+
+def apply_plan(
+    json_data: Dict[str, Any],
+    plan: Tuple[Mapping[str, Any], ...],
+    shape_cache: Optional[ShapeCache] = None,
+) -> Dict[str, Any]:
+    """Apply a plan made by compile_jsonlt to a copy of json_data."""
+    transformed_data = copy.deepcopy(json_data)
+    return apply_transformations(transformed_data, plan, shape_cache)
+
+
+def jsonlt_transform(
+    json_data: Dict[str, Any],
+    jsonlt_conf: Dict[str, Any],
+    shape_cache: Optional[ShapeCache] = None,
+) -> Dict[str, Any]:
+    if shape_cache is not None:
+        # A compiled plan compares equal to the same one compiled by earlier
+        # calls, so their runs and the shapes cached for them are reused
+        return apply_plan(json_data, compile_jsonlt(jsonlt_conf), shape_cache)
+    # The plan is only used for this call, so freezing it would not pay off
+    return apply_plan(json_data, bind_plan(jsonlt_conf, {}))
+
+
+def gil_disabled() -> bool:
+    """Tell whether this interpreter runs without the GIL (free-threaded CPython)."""
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+# Plan of the current worker process, set up by init_worker
+worker_plan: Tuple[Mapping[str, Any], ...] = ()
+
+
+def init_worker(jsonlt_conf: Dict[str, Any]) -> None:
+    global worker_plan
+    worker_plan = compile_jsonlt(jsonlt_conf)
+
+
+def transform_in_worker(json_data: Dict[str, Any]) -> Dict[str, Any]:
+    return apply_transformations(json_data, worker_plan)
+
+
+def jsonlt_transform_many(
+    records: Iterable[Dict[str, Any]],
+    jsonlt_conf: Dict[str, Any],
+    backend: str = "auto",
+    max_workers: Optional[int] = None,
+    shape_cache: Optional[ShapeCache] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Apply a JSONLT configuration to each of many records in parallel.
+
+    The "threads" backend shares one compiled plan (and shape_cache, if given)
+    between threads and avoids pickling; it only runs in parallel on
+    free-threaded Python. The "processes" backend pickles records to worker
+    processes, which each compile their own plan. "auto" picks threads when the
+    GIL is disabled and processes otherwise. Results keep the order of records.
+    """
+    if backend == "auto":
+        backend = "threads" if gil_disabled() else "processes"
+    records = list(records)
+    workers = max_workers or os.cpu_count() or 1
+
+    if backend == "threads":
+        plan = compile_jsonlt(jsonlt_conf)
+        with ThreadPoolExecutor(workers) as executor:
+            return list(
+                executor.map(
+                    lambda record: apply_plan(record, plan, shape_cache), records
+                )
+            )
+    elif backend == "processes":
+        if shape_cache is not None:
+            raise ValueError("shape_cache can only be shared by the threads backend")
+        # Validate in this process so configuration errors are raised here, and
+        # build memory-mapped lookup indexes once before the workers open them;
+        # the workers load the reference tables themselves
+        for transformation in JSONLT(**jsonlt_conf).transformations:
+            for lookup in iter_lookups(transformation.model_dump()):
+                if lookup["index"] == "mmap":
+                    MappedTable.ensure_index(
+                        lookup["reference"], lookup["reference_key"] or lookup["key"]
+                    ).close()
+                elif not os.path.isfile(lookup["reference"]):
+                    raise FileNotFoundError(
+                        f"Lookup reference not found: {lookup['reference']}"
+                    )
+        chunksize = max(1, len(records) // (workers * 4))
+        with ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(jsonlt_conf,)
+        ) as executor:
+            return list(executor.map(transform_in_worker, records, chunksize=chunksize))
+    raise ValueError(f"Unknown backend: {backend!r}")
+
+
+def jsonlt_transform_fanout(
+    json_data: Dict[str, Any], jsonlt_confs: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Apply several JSONLT configurations to the same input data.
+
+    Leading transformations that configurations have in common are applied once,
+    and the data is only copied at the points where the configurations diverge.
+    Results are returned in the same order as jsonlt_confs.
+    """
+    lookup_tables: Dict[Any, Any] = {}
+    plans = [compile_jsonlt(conf, lookup_tables) for conf in jsonlt_confs]
+    results: List[Any] = [None] * len(plans)
+    if plans:
+        fan_out(copy.deepcopy(json_data), plans, list(range(len(plans))), 0, results)
+    return results
+
+
+def fan_out(
+    data: Dict[str, Any],
+    plans: List[Tuple[Mapping[str, Any], ...]],
+    members: List[int],
+    depth: int,
+    results: List[Any],
+) -> None:
+    """
+    Run the plans listed in members, which all share their first depth steps.
+
+    While every member continues with the same step, that step is applied to data
+    in place. Where members finish or diverge, each consumer except the last gets
+    its own deep copy and the last one takes data itself.
+    """
+    while True:
+        finished = []
+        branches: List[Any] = []
+        for index in members:
+            if len(plans[index]) == depth:
+                finished.append(index)
+                continue
+            step = plans[index][depth]
+            for branch_step, branch_members in branches:
+                if branch_step == step:
+                    branch_members.append(index)
+                    break
+            else:
+                branches.append((step, [index]))
+
+        if not finished and len(branches) == 1:
+            data = apply_transformation(data, branches[0][0])
+            depth += 1
+            continue
+
+        consumers = len(finished) + len(branches)
+        for i, index in enumerate(finished):
+            last = i == consumers - 1
+            results[index] = data if last else copy.deepcopy(data)
+        for i, (step, branch_members) in enumerate(branches, start=len(finished)):
+            last = i == consumers - 1
+            branch_data = data if last else copy.deepcopy(data)
+            branch_data = apply_transformation(branch_data, step)
+            fan_out(branch_data, plans, branch_members, depth + 1, results)
+        return